@@ -17,6 +17,11 @@ def get_db():
     if db is None:
         db = g._database = sqlite3.connect(DATABASE)
         db.row_factory = sqlite3.Row
+        # Per-connection settings; journal_mode=WAL is persisted in the file by init_db
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        db.execute("PRAGMA temp_store=MEMORY")
+        db.execute("PRAGMA cache_size=-20000")
     return db
 
 
@@ -28,10 +33,32 @@ def close_connection(exception):
         db.close()
 
 
+def parse_tags(tags):
+    """Split a comma-separated tags string into stripped, non-empty tags."""
+    # Untagged questions store "" or NULL; skip the split for them
+    if not tags:
+        return []
+    stripped = tags.strip()
+    if not stripped:
+        return []
+    return [t for t in (part.strip() for part in stripped.split(',')) if t]
+
+
+def sync_question_tags(db, qid, tags):
+    """Replace the question_tags rows of a question with the tags from its tags string."""
+    db.execute("DELETE FROM question_tags WHERE question_id=?", (qid,))
+    db.executemany(
+        "INSERT OR IGNORE INTO question_tags (question_id, tag) VALUES (?, ?)",
+        [(qid, t) for t in dict.fromkeys(parse_tags(tags))]
+    )
+
+
 def init_db():
-    """Initialize the database with the questions table."""
+    """Initialize the database with the questions and question_tags tables."""
     with app.app_context():
         db = get_db()
+        # WAL lets quiz readers proceed while an admin write is in progress
+        db.execute("PRAGMA journal_mode=WAL")
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS questions (
@@ -46,6 +73,28 @@ def init_db():
             );
             """
         )
+        # One row per (question, tag) so tag filters are index lookups instead of LIKE scans
+        has_tag_table = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='question_tags'"
+        ).fetchone() is not None
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS question_tags (
+                question_id INTEGER NOT NULL,
+                tag TEXT NOT NULL COLLATE NOCASE,
+                PRIMARY KEY (question_id, tag)
+            );
+            """
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_qt_tag ON question_tags(tag)")
+        if not has_tag_table:
+            # Backfill from the comma-separated tags column of existing questions, split
+            # with parse_tags so the rows match those written by add and edit
+            rows = db.execute("SELECT id, tags FROM questions WHERE tags IS NOT NULL").fetchall()
+            db.executemany(
+                "INSERT OR IGNORE INTO question_tags (question_id, tag) VALUES (?, ?)",
+                [(row[0], t) for row in rows for t in dict.fromkeys(parse_tags(row[1]))]
+            )
         db.commit()
 
 
@@ -72,24 +121,31 @@ def quiz():
     # When the user submits answers
     if request.method == 'POST':
         # form keys are in the form "question-{id}" with value one of 'A','B','C','D'
-        answers = {key.split('-')[1]: value for key, value in request.form.items() if key.startswith('question-')}
-        # Fetch the relevant questions to check answers
-        placeholders = ','.join('?' for _ in answers)
-        query = f"SELECT id, correct_option FROM questions WHERE id IN ({placeholders})"
-        cur = db.execute(query, list(answers.keys()))
-        result_set = cur.fetchall()
-        total = len(result_set)
-        correct = 0
-        detailed_results = []
-        # Evaluate each question's answer
-        for row in result_set:
-            qid = str(row['id'])
-            correct_answer = row['correct_option']
-            user_answer = answers.get(qid)
-            is_correct = (user_answer == correct_answer)
-            if is_correct:
-                correct += 1
-            detailed_results.append({'id': qid, 'user_answer': user_answer, 'correct_answer': correct_answer, 'is_correct': is_correct})
+        # Keys are converted to int once so they bind straight to questions.id
+        answers = {
+            int(key.split('-')[1]): value for key, value in request.form.items()
+            if key.startswith('question-') and key.split('-')[1].isdecimal()
+        }
+        # Evaluate the answers inside SQLite by joining the submitted (id, answer) pairs
+        # against questions; window aggregates return the totals with each row
+        pairs = ','.join('(?, ?)' for _ in answers)
+        params = [value for pair in answers.items() for value in pair]
+        query = (
+            f"WITH ans(id, user_answer) AS (VALUES {pairs}) "
+            "SELECT q.id, ans.user_answer, q.correct_option, "
+            "ans.user_answer = q.correct_option AS is_correct, "
+            "SUM(ans.user_answer = q.correct_option) OVER () AS correct, "
+            "COUNT(*) OVER () AS total "
+            "FROM ans JOIN questions q ON q.id = ans.id ORDER BY q.id"
+        )
+        result_set = db.execute(query, params).fetchall() if answers else []
+        # Columns by position: id, user_answer, correct_option, is_correct, correct, total
+        total = result_set[0][5] if result_set else 0
+        correct = result_set[0][4] if result_set else 0
+        detailed_results = [
+            {'id': str(row[0]), 'user_answer': row[1], 'correct_answer': row[2], 'is_correct': bool(row[3])}
+            for row in result_set
+        ]
         score_percent = 0
         if total > 0:
             score_percent = round(correct / total * 100, 2)
@@ -97,23 +153,19 @@ def quiz():
 
     # GET method: display the quiz
     tag_filter = request.args.get('tag', '').strip()
+    # Only the columns quiz.html renders; correct_option must never reach the page
     if tag_filter:
-        # Filter questions by tag (case-insensitive match among comma-separated tags)
-        # Use LIKE with wildcards to find substring match
-        like_pattern = f"%{tag_filter}%"
-        cur = db.execute("SELECT * FROM questions WHERE lower(tags) LIKE lower(?) ORDER BY id", (like_pattern,))
+        # Filter questions by tag (case-insensitive), including descendants such as "数学/代数" for "数学"
+        cur = db.execute(
+            "SELECT id, question, option_a, option_b, option_c, option_d FROM questions"
+            " WHERE id IN (SELECT question_id FROM question_tags"
+            " WHERE tag = ? OR (tag > ? AND tag < ?)) ORDER BY id",
+            (tag_filter, tag_filter + '/', tag_filter + '0')
+        )
     else:
-        cur = db.execute("SELECT * FROM questions ORDER BY id")
-    questions = cur.fetchall()
-    # Retrieve list of distinct tags to populate tag filter list
-    tag_cur = db.execute("SELECT tags FROM questions")
-    tags_all = []
-    for row in tag_cur.fetchall():
-        if row['tags']:
-            # split by comma and strip whitespace
-            tags_all.extend([t.strip() for t in row['tags'].split(',') if t.strip()])
-    tags_unique = sorted(set(tags_all))
-    return render_template('quiz.html', questions=questions, tags=tags_unique, selected_tag=tag_filter)
+        cur = db.execute("SELECT id, question, option_a, option_b, option_c, option_d FROM questions ORDER BY id")
+    # The cursor is iterated directly by the template instead of being materialized with fetchall()
+    return render_template('quiz.html', questions=cur, selected_tag=tag_filter)
 
 
 @app.route('/admin')
@@ -121,8 +173,7 @@ def admin():
     """List all questions with options to edit or delete."""
     db = get_db()
     cur = db.execute("SELECT * FROM questions ORDER BY id")
-    questions = cur.fetchall()
-    return render_template('admin.html', questions=questions)
+    return render_template('admin.html', questions=cur)
 
 
 @app.route('/admin/add', methods=['GET', 'POST'])
@@ -140,10 +191,11 @@ def add_question():
             flash('请填写所有字段。', 'error')
         else:
             db = get_db()
-            db.execute(
+            cur = db.execute(
                 "INSERT INTO questions (question, option_a, option_b, option_c, option_d, correct_option, tags) VALUES (?, ?, ?, ?, ?, ?, ?)",
                 (question, option_a, option_b, option_c, option_d, correct_option, tags)
             )
+            sync_question_tags(db, cur.lastrowid, tags)
             db.commit()
             flash('题目已添加。', 'success')
             return redirect(url_for('admin'))
@@ -175,6 +227,7 @@ def edit_question(qid):
                 "UPDATE questions SET question=?, option_a=?, option_b=?, option_c=?, option_d=?, correct_option=?, tags=? WHERE id=?",
                 (question, option_a, option_b, option_c, option_d, correct_option, tags, qid)
             )
+            sync_question_tags(db, qid, tags)
             db.commit()
             flash('题目已更新。', 'success')
             return redirect(url_for('admin'))
@@ -197,6 +250,7 @@ def delete_question(qid):
     """Delete a question by ID."""
     db = get_db()
     db.execute("DELETE FROM questions WHERE id=?", (qid,))
+    db.execute("DELETE FROM question_tags WHERE question_id=?", (qid,))
     db.commit()
     flash('题目已删除。', 'success')
     return redirect(url_for('admin'))
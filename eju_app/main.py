@@ -1,83 +1,557 @@
+import asyncio
+import hashlib
+import logging
 import os
+import queue
 import sqlite3
-from typing import Optional, Dict, List
-
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache, wraps
+from typing import Callable, Optional, Dict, List, Set, Tuple
+
+import jinja2
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
 
 import urllib.parse
 
 app = FastAPI(title="EJU Quiz App")
+logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE = os.path.join(BASE_DIR, "questions.db")
 
 # Set up Jinja2 templates directory
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
+# Set EJU_TEMPLATE_CACHE_DIR to keep compiled templates on disk, so a restarted process
+# skips parsing them again. Off by default: the package directory may be read-only.
+JINJA_CACHE_DIR = os.environ.get("EJU_TEMPLATE_CACHE_DIR")
+if JINJA_CACHE_DIR:
+    try:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    except OSError:
+        logger.warning("Cannot create template cache directory %s", JINJA_CACHE_DIR, exc_info=True)
+    # Jinja writes the cache without error handling, so an unwritable directory would fail renders
+    if os.access(JINJA_CACHE_DIR, os.W_OK):
+        templates.env.bytecode_cache = jinja2.FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    else:
+        logger.warning("Template cache directory %s is not writable; caching disabled", JINJA_CACHE_DIR)
+# Skip the per-render mtime check; set EJU_TEMPLATE_RELOAD=1 while editing templates
+templates.env.auto_reload = os.environ.get("EJU_TEMPLATE_RELOAD") == "1"
+
+
+def quiz_page_token() -> str:
+    """
+    Fingerprint of the code that renders /quiz (quiz.html and this module). It is part of
+    the /quiz ETag, so a deploy that changes the page invalidates validators clients hold.
+    """
+    digest = hashlib.sha1()
+    for path in (os.path.join(BASE_DIR, "templates", "quiz.html"), os.path.abspath(__file__)):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+QUIZ_PAGE_TOKEN = quiz_page_token()
+
+
+# Number of pooled read connections; writes go through a single dedicated connection
+POOL_SIZE = 4
+
+_pool: Optional["queue.Queue[sqlite3.Connection]"] = None
+_writer: Optional[sqlite3.Connection] = None
+_write_lock = asyncio.Lock()
+
+# Read results keyed by (questions_revision.rev, ...). The revision is bumped by triggers
+# on every change from any process, so a write makes earlier entries unreachable
+_READ_CACHE: Dict[Tuple, object] = {}
+
+# Form fields of a question, in the column order used by SQL_INSERT_QUESTION / SQL_UPDATE_QUESTION
+QUESTION_FIELDS = ("question", "option_a", "option_b", "option_c", "option_d", "correct_option", "tags", "section")
+# Fields every question must fill in; tags and section may be left empty
+REQUIRED_FIELDS = QUESTION_FIELDS[:6]
+CORRECT_OPTIONS = frozenset("ABCD")
+
+# Schema version recorded in PRAGMA user_version; bump it when init_db gains a migration step
+SCHEMA_VERSION = 4
+
+# Attempts made by retry_on_locked before a "database is locked" error reaches the user
+WRITE_RETRIES = 5
+
+# Statement cache size per connection; pooled connections keep their prepared statements
+CACHED_STATEMENTS = 256
+
+# Entries kept in _READ_CACHE before it is emptied; covers every section for a few revisions
+READ_CACHE_SIZE = 64
+
+# SQL kept as module-level constants so every call hits the same statement cache entry
+SQL_SELECT_ADMIN_QUESTIONS = "SELECT id, question, tags, section, correct_option FROM questions ORDER BY id"
+SQL_SELECT_QUESTION_BY_ID = (
+    "SELECT id, question, option_a, option_b, option_c, option_d, correct_option, tags, section"
+    " FROM questions WHERE id=?"
+)
+SQL_INSERT_QUESTION = (
+    "INSERT INTO questions (question, option_a, option_b, option_c, option_d, correct_option, tags, section)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_UPDATE_QUESTION = (
+    "UPDATE questions SET question=?, option_a=?, option_b=?, option_c=?, option_d=?, correct_option=?, tags=?, section=?"
+    " WHERE id=?"
+)
+SQL_DELETE_QUESTION = "DELETE FROM questions WHERE id=?"
+SQL_DELETE_QUESTION_TAGS = "DELETE FROM question_tags WHERE question_id=?"
+SQL_DELETE_TAGS_AFTER_ID = "DELETE FROM question_tags WHERE question_id > ?"
+SQL_INSERT_QUESTION_TAG = "INSERT OR IGNORE INTO question_tags (question_id, tag) VALUES (?, ?)"
+SQL_SELECT_TAGS_AFTER_ID = "SELECT id, tags FROM questions WHERE id > ? AND tags IS NOT NULL"
+SQL_SELECT_REVISION = "SELECT rev FROM questions_revision"
+SQL_SELECT_TAGS = "SELECT DISTINCT tag FROM question_tags"
+SQL_SELECT_SECTION_TAGS = (
+    "SELECT DISTINCT t.tag FROM question_tags t"
+    " JOIN questions q ON q.id = t.question_id WHERE q.section = ?"
+)
+
+# Filter flags of the /quiz question query
+QUIZ_SECTION = 1
+QUIZ_TAG = 2
+
+
+def _build_quiz_queries() -> Dict[int, str]:
+    """
+    Build the /quiz question query for every filter combination, keyed by
+    QUIZ_SECTION | QUIZ_TAG flags, so each request reuses a constant statement.
+    """
+    # Only the columns quiz.html renders; correct_option must never reach the page
+    base_query = "SELECT id, question, option_a, option_b, option_c, option_d FROM questions"
+    queries = {}
+    for flags in range(4):
+        conditions = []
+        if flags & QUIZ_SECTION:
+            conditions.append("section = ?")
+        if flags & QUIZ_TAG:
+            # Match the tag itself or any of its descendants ("数学" also matches "数学/代数")
+            conditions.append(
+                "id IN (SELECT question_id FROM question_tags"
+                " WHERE tag = ? OR (tag > ? AND tag < ?))"
+            )
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        queries[flags] = base_query + where + " ORDER BY id"
+    return queries
+
+
+_QUIZ_QUERIES = _build_quiz_queries()
+
+
+def question_query(section: Optional[str], tag: Optional[str]) -> Tuple[str, Tuple]:
+    """Return the precomputed /quiz question statement and its parameters for the filters."""
+    flags = 0
+    params: Tuple = ()
+    if section:
+        flags |= QUIZ_SECTION
+        params += (section,)
+    if tag:
+        flags |= QUIZ_TAG
+        params += (tag, tag + "/", tag + "0")
+    return _QUIZ_QUERIES[flags], params
+
+
+def tag_query(section: Optional[str]) -> Tuple[str, Tuple]:
+    """Return the statement and parameters listing the distinct tags of a section, or of all."""
+    if section:
+        return SQL_SELECT_SECTION_TAGS, (section,)
+    return SQL_SELECT_TAGS, ()
+
+
+def connect() -> sqlite3.Connection:
+    """Open a new database connection with row_factory set to sqlite3.Row."""
+    conn = sqlite3.connect(DATABASE, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row
+    # Per-connection settings; journal_mode=WAL is persisted in the file by init_db
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    # Map up to 256 MiB of the file so page reads skip the read() syscall
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+
+def init_pool():
+    """Open the read connection pool and the writer connection."""
+    global _pool, _writer
+    _pool = queue.Queue(maxsize=POOL_SIZE)
+    for _ in range(POOL_SIZE):
+        _pool.put(connect())
+    _writer = connect()
+    # Autocommit mode: writes manage their own BEGIN IMMEDIATE transactions
+    _writer.isolation_level = None
+
+
+def close_pool():
+    """Close every pooled connection."""
+    global _pool, _writer
+    if _pool is not None:
+        while not _pool.empty():
+            _pool.get_nowait().close()
+        _pool = None
+    if _writer is not None:
+        _writer.close()
+        _writer = None
 
 
+@contextmanager
 def get_db():
-    """Return a new database connection with row_factory set to sqlite3.Row."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Borrow a read connection from the pool and put it back afterwards."""
+    conn = _pool.get()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put(conn)
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """
+    Run the block in a BEGIN IMMEDIATE transaction on the writer connection.
+    Taking the write lock up front avoids the deferred-to-write upgrade that can
+    fail with SQLITE_BUSY under WAL, and the whole block costs a single commit.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        # A failed COMMIT can leave the transaction open; the shared writer must not stay in it
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+@asynccontextmanager
+async def get_write_db():
+    """Hold the writer connection; SQLite allows only one writer at a time."""
+    async with _write_lock:
+        yield _writer
+
+
+def parse_tags(tags: Optional[str]) -> List[str]:
+    """Split a comma-separated tags string into stripped, non-empty tags."""
+    # Untagged questions store "" or NULL; skip the split for them
+    if not tags:
+        return []
+    stripped = tags.strip()
+    if not stripped:
+        return []
+    return [t for t in (part.strip() for part in stripped.split(",")) if t]
+
+
+def sync_question_tags(conn: sqlite3.Connection, qid: int, tags: Optional[str]):
+    """Replace the question_tags rows of a question with the tags from its tags string."""
+    conn.execute(SQL_DELETE_QUESTION_TAGS, (qid,))
+    # dict.fromkeys drops repeated tags before they reach SQLite, keeping their order
+    conn.executemany(SQL_INSERT_QUESTION_TAG, [(qid, t) for t in dict.fromkeys(parse_tags(tags))])
+
+
+def insert_tags_from_questions(conn: sqlite3.Connection, after_id: int):
+    """
+    Add question_tags rows for every question with an id above after_id. Tags are split
+    with parse_tags, like single writes, so every path strips the same whitespace
+    (SQLite's trim() would keep tabs and full-width spaces).
+    """
+    # Drop rows left behind for ids above after_id so new questions never inherit them
+    conn.execute(SQL_DELETE_TAGS_AFTER_ID, (after_id,))
+    rows = conn.execute(SQL_SELECT_TAGS_AFTER_ID, (after_id,)).fetchall()
+    conn.executemany(
+        SQL_INSERT_QUESTION_TAG,
+        [(row[0], t) for row in rows for t in dict.fromkeys(parse_tags(row[1]))],
+    )
 
 
-def init_db():
-    """Create the questions table if it does not already exist, and add section column if missing."""
-    with get_db() as conn:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS questions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                question TEXT NOT NULL,
-                option_a TEXT NOT NULL,
-                option_b TEXT NOT NULL,
-                option_c TEXT NOT NULL,
-                option_d TEXT NOT NULL,
-                correct_option TEXT NOT NULL,
-                tags TEXT,
-                section TEXT
-            );
-            """
+def warm_caches():
+    """
+    Load the admin list and the all-sections tag hierarchy for the current revision.
+    Every admin write redirects to /admin, so that GET and the next /quiz find their data
+    already cached. A failure only means the next GET queries the database itself.
+    """
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN")
+            revision = read_revision(conn)
+            get_admin_questions(conn, revision)
+            get_tags_hierarchy(conn, revision, "")
+    except Exception:
+        logger.warning("Could not warm caches after a write", exc_info=True)
+
+
+def retry_on_locked(fn):
+    """
+    Retry a write with exponential backoff when SQLite reports the database as locked.
+    busy_timeout already absorbs short waits; this only covers bursts that outlast it.
+    Each attempt runs its own transaction, so a failed attempt leaves nothing behind.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(WRITE_RETRIES):
+            try:
+                return fn(*args, **kwargs)
+            except sqlite3.OperationalError as exc:
+                if "locked" not in str(exc) or attempt == WRITE_RETRIES - 1:
+                    raise
+                time.sleep(0.01 * (2 ** attempt))
+    return wrapper
+
+
+@retry_on_locked
+def insert_question(conn: sqlite3.Connection, payload: Dict[str, str]):
+    """Insert a new question together with its tag rows."""
+    with transaction(conn):
+        cur = conn.execute(SQL_INSERT_QUESTION, tuple(payload[f] for f in QUESTION_FIELDS))
+        sync_question_tags(conn, cur.lastrowid, payload["tags"])
+
+
+@retry_on_locked
+def insert_questions(conn: sqlite3.Connection, payloads: List[Dict[str, str]]) -> int:
+    """Insert many questions and their tag rows in a single transaction; return the count."""
+    with transaction(conn):
+        # AUTOINCREMENT ids only grow, so every new row has an id above the current maximum
+        last_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM questions").fetchone()[0]
+        conn.executemany(
+            SQL_INSERT_QUESTION,
+            [tuple(payload[f] for f in QUESTION_FIELDS) for payload in payloads],
         )
-        # Ensure the section column exists even if the table was created earlier
-        cur = conn.execute("PRAGMA table_info(questions)")
-        columns = [row[1] for row in cur.fetchall()]
-        if "section" not in columns:
-            conn.execute("ALTER TABLE questions ADD COLUMN section TEXT")
-        conn.commit()
+        insert_tags_from_questions(conn, last_id)
+    return len(payloads)
+
+
+@retry_on_locked
+def update_question(conn: sqlite3.Connection, qid: int, payload: Dict[str, str]) -> bool:
+    """Overwrite an existing question and resync its tag rows; return False if it does not exist."""
+    with transaction(conn):
+        cur = conn.execute(SQL_UPDATE_QUESTION, tuple(payload[f] for f in QUESTION_FIELDS) + (qid,))
+        if cur.rowcount == 0:
+            # Deleted meanwhile (e.g. by another admin); writing tags would leave orphan rows
+            return False
+        sync_question_tags(conn, qid, payload["tags"])
+    return True
+
+
+@retry_on_locked
+def remove_question(conn: sqlite3.Connection, qid: int):
+    """Delete a question and its tag rows."""
+    with transaction(conn):
+        conn.execute(SQL_DELETE_QUESTION, (qid,))
+        conn.execute(SQL_DELETE_QUESTION_TAGS, (qid,))
+
+
+def question_payload(item: Dict) -> Optional[Dict[str, str]]:
+    """
+    Build an insertable payload from a JSON question object, or return None when a
+    required field is missing or empty, correct_option is not A-D, or a field is not a string.
+    """
+    payload: Dict[str, str] = {}
+    for field in QUESTION_FIELDS:
+        value = item.get(field)
+        if value is None and field not in REQUIRED_FIELDS:
+            value = ""
+        if not isinstance(value, str):
+            return None
+        payload[field] = value.strip()
+    if not all(payload[field] for field in REQUIRED_FIELDS):
+        return None
+    if payload["correct_option"] not in CORRECT_OPTIONS:
+        return None
+    return payload
+
+
+def parse_form_body(body: bytes) -> Dict[str, str]:
+    """
+    Parse a URL-encoded form body into a flat dict of stripped values, keeping the first
+    value of each field. Starlette's request.form() requires python-multipart even for
+    URL-encoded bodies, so the standard library parser is used to avoid that dependency.
+    """
+    data: Dict[str, str] = {}
+    for key, value in urllib.parse.parse_qsl(body.decode("utf-8", "replace")):
+        data.setdefault(key, value.strip())
+    return data
+
+
+async def form_dict(request: Request) -> Dict[str, str]:
+    """Dependency that reads and parses the form body once per request."""
+    return parse_form_body(await request.body())
+
+
+def fetch_all(sql: str, params=()) -> List[sqlite3.Row]:
+    """Run a read query on a pooled connection and return every row."""
+    with get_db() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def read_revision(conn: sqlite3.Connection) -> int:
+    """Return questions_revision.rev, which changes whenever any process changes questions."""
+    return conn.execute(SQL_SELECT_REVISION).fetchone()[0]
+
+
+def cached_read(conn: sqlite3.Connection, revision: int, key: Tuple, load: Callable):
+    """
+    Return load(conn), memoized under (revision,) + key. Callers read the revision on the
+    same connection first, so a cached entry is never older than the revision it is keyed on.
+    """
+    entry_key = (revision,) + key
+    try:
+        return _READ_CACHE[entry_key]
+    except KeyError:
+        pass
+    value = load(conn)
+    if len(_READ_CACHE) >= READ_CACHE_SIZE:
+        _READ_CACHE.clear()
+    _READ_CACHE[entry_key] = value
+    return value
+
+
+def _load_admin_questions(conn: sqlite3.Connection) -> List[sqlite3.Row]:
+    return conn.execute(SQL_SELECT_ADMIN_QUESTIONS).fetchall()
+
+
+def get_admin_questions(conn: sqlite3.Connection, revision: int) -> List[sqlite3.Row]:
+    """Return the admin question list, querying the database only when the revision changed."""
+    return cached_read(conn, revision, ("admin",), _load_admin_questions)
+
+
+def get_tags_hierarchy(conn: sqlite3.Connection, revision: int, section: str) -> Dict[str, List[str]]:
+    """Return the tag hierarchy of a section ("" for all sections) at the given revision."""
+    def load(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+        # Collect all tags (within the selected section, if any)
+        rows = conn.execute(*tag_query(section)).fetchall()
+        return build_tag_hierarchy(tuple(sorted(row[0] for row in rows)))
+    return cached_read(conn, revision, ("tags", section), load)
+
+
+def fetch_question(qid: int) -> Optional[Tuple]:
+    """Return a single question as a tuple in SQL_SELECT_QUESTION_BY_ID column order, or None."""
+    with get_db() as conn:
+        row = conn.execute(SQL_SELECT_QUESTION_BY_ID, (qid,)).fetchone()
+    return tuple(row) if row is not None else None
+
+
+def init_db():
+    """
+    Bring the schema up to SCHEMA_VERSION. The applied version is stored in
+    PRAGMA user_version, so an up-to-date database needs no further introspection.
+    """
+    # WAL lets quiz readers proceed while an admin write is in progress;
+    # the journal mode cannot be changed inside a transaction
+    _writer.execute("PRAGMA journal_mode=WAL")
+    version = _writer.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    with transaction(_writer) as conn:
+        if version < 1:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS questions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    question TEXT NOT NULL,
+                    option_a TEXT NOT NULL,
+                    option_b TEXT NOT NULL,
+                    option_c TEXT NOT NULL,
+                    option_d TEXT NOT NULL,
+                    correct_option TEXT NOT NULL,
+                    tags TEXT,
+                    section TEXT
+                );
+                """
+            )
+        if version < 2:
+            # Tables created before the section column existed need it added
+            cur = conn.execute("PRAGMA table_info(questions)")
+            columns = [row[1] for row in cur.fetchall()]
+            if "section" not in columns:
+                conn.execute("ALTER TABLE questions ADD COLUMN section TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_section ON questions(section)")
+        if version < 3:
+            # One row per (question, tag) so tag filters are index lookups instead of LIKE scans
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS question_tags (
+                    question_id INTEGER NOT NULL,
+                    tag TEXT NOT NULL COLLATE NOCASE,
+                    PRIMARY KEY (question_id, tag)
+                );
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_qt_tag ON question_tags(tag)")
+            # Rebuild from the comma-separated tags column of existing questions
+            conn.execute("DELETE FROM question_tags")
+            insert_tags_from_questions(conn, 0)
+        if version < 4:
+            # Revision counter bumped by triggers on every change to questions, whichever
+            # process or app made it; /quiz derives its ETag from it
+            conn.execute("CREATE TABLE IF NOT EXISTS questions_revision (rev INTEGER NOT NULL)")
+            conn.execute(
+                "INSERT INTO questions_revision (rev)"
+                " SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM questions_revision)"
+            )
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS trg_questions_revision_{event.lower()}"
+                    f" AFTER {event} ON questions"
+                    " BEGIN UPDATE questions_revision SET rev = rev + 1; END"
+                )
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
 
 
 @app.on_event("startup")
 def on_startup():
-    """Ensure the database is initialized when the app starts."""
+    """Open the connection pool and ensure the database is initialized when the app starts."""
+    init_pool()
     init_db()
 
 
-def build_tag_hierarchy(tags: List[str]) -> Dict[str, List[str]]:
+@app.on_event("shutdown")
+def on_shutdown():
+    """Close pooled connections when the app stops."""
+    close_pool()
+
+
+@lru_cache(maxsize=8)
+def build_tag_hierarchy(tags: Tuple[str, ...]) -> Dict[str, List[str]]:
     """
-    Build a hierarchical dictionary of tags from a flat list. Tags with slashes indicate parent/child relationships.
-    Example: ["数学/代数", "数学/几何", "日语"] -> {"数学": ["代数", "几何"], "日语": []}
+    Build a hierarchical dictionary of tags from a flat tuple. Tags with slashes indicate parent/child relationships.
+    Example: ("数学/代数", "数学/几何", "日语") -> {"数学": ["代数", "几何"], "日语": []}
     """
-    hierarchy: Dict[str, List[str]] = {}
+    hierarchy: Dict[str, Set[str]] = {}
     for tag in tags:
-        parts = [p.strip() for p in tag.split("/") if p.strip()]
-        if not parts:
+        # Only the first slash separates parent from child; deeper levels stay in the child
+        parent, sep, child = tag.partition("/")
+        parent = parent.strip()
+        if not parent:
             continue
-        parent = parts[0]
-        if len(parts) == 1:
-            hierarchy.setdefault(parent, [])
-        else:
-            child = "/".join(parts[1:])
-            hierarchy.setdefault(parent, [])
-            if child not in hierarchy[parent]:
-                hierarchy[parent].append(child)
+        children = hierarchy.setdefault(parent, set())
+        child = child.strip()
+        if sep and child:
+            children.add(child)
     # Sort children and parents for consistent ordering
-    for parent in hierarchy:
-        hierarchy[parent].sort()
-    return dict(sorted(hierarchy.items()))
+    return {parent: sorted(children) for parent, children in sorted(hierarchy.items())}
+
+
+@lru_cache(maxsize=None)
+def score_query(size: int) -> str:
+    """
+    Build the statement that scores `size` submitted (id, answer) pairs.
+    The pairs are joined against questions inside SQLite, and window aggregates
+    return the correct/total counts alongside each evaluated row.
+    """
+    pairs = ",".join("(?, ?)" for _ in range(size))
+    return (
+        f"WITH ans(id, user_answer) AS (VALUES {pairs}) "
+        "SELECT q.id, ans.user_answer, q.correct_option, "
+        "ans.user_answer = q.correct_option AS is_correct, "
+        "SUM(ans.user_answer = q.correct_option) OVER () AS correct, "
+        "COUNT(*) OVER () AS total "
+        "FROM ans JOIN questions q ON q.id = ans.id ORDER BY q.id"
+    )
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -86,94 +560,81 @@ async def home(request: Request):
     return templates.TemplateResponse("home.html", {"request": request})
 
 
+# Handlers that only read from SQLite are plain functions so FastAPI runs them in its
+# threadpool; async handlers hand their database work to asyncio.to_thread instead.
 @app.get("/quiz", response_class=HTMLResponse)
-async def quiz(
+def quiz(
     request: Request,
     tag: Optional[str] = None,
     section: Optional[str] = None,
 ):
     """Display the quiz page with optional section and tag filters."""
     with get_db() as conn:
-        base_query = "SELECT * FROM questions"
-        conditions = []
-        params = []
-        if section:
-            conditions.append("section = ?")
-            params.append(section)
-        if tag:
-            conditions.append("lower(tags) LIKE lower(?)")
-            params.append(f"%{tag}%")
-        if conditions:
-            base_query += " WHERE " + " AND ".join(conditions)
-        base_query += " ORDER BY id"
-        cur = conn.execute(base_query, tuple(params))
-        questions = cur.fetchall()
-
-        # Collect all tags (within the selected section, if any)
-        tag_query = "SELECT tags FROM questions"
-        tag_params = ()
-        if section:
-            tag_query += " WHERE section = ?"
-            tag_params = (section,)
-        tag_cur = conn.execute(tag_query, tag_params)
-        tags_all = []
-        for row in tag_cur.fetchall():
-            if row[0]:
-                tags_all.extend([t.strip() for t in row[0].split(",") if t.strip()])
-        tags_unique = sorted(set(tags_all))
-        tags_hierarchy = build_tag_hierarchy(tags_unique)
-
-    return templates.TemplateResponse(
-        "quiz.html",
-        {
-            "request": request,
-            "questions": questions,
-            "tags_hierarchy": tags_hierarchy,
-            "selected_tag": tag or "",
-            "selected_section": section or "",
-        },
-    )
+        # One read transaction for the revision, question and tag queries: SQLite takes its
+        # shared lock once and the ETag describes exactly the snapshot being rendered.
+        # get_db() rolls it back when the connection returns to the pool.
+        conn.execute("BEGIN")
+        # The page only changes when questions or the deployed page code do, so clients
+        # revalidate against both
+        revision = read_revision(conn)
+        # With template reloading on, quiz.html may change while the process runs
+        token = quiz_page_token() if templates.env.auto_reload else QUIZ_PAGE_TOKEN
+        etag = f'W/"{token}-{revision}"'
+        cache_headers = {"ETag": etag, "Cache-Control": "private, must-revalidate"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in (value.strip() for value in if_none_match.split(",")):
+            return Response(status_code=304, headers=cache_headers)
+
+        tags_hierarchy = get_tags_hierarchy(conn, revision, section or "")
+        # Rows are streamed from the cursor while the template renders
+        questions = conn.execute(*question_query(section, tag))
+
+        # Render before the connection goes back to the pool
+        return templates.TemplateResponse(
+            "quiz.html",
+            {
+                "request": request,
+                "questions": questions,
+                "tags_hierarchy": tags_hierarchy,
+                "selected_tag": tag or "",
+                "selected_section": section or "",
+            },
+            headers=cache_headers,
+        )
 
 
 @app.post("/quiz", response_class=HTMLResponse)
-async def submit_quiz(request: Request):
+async def submit_quiz(request: Request, form: Dict[str, str] = Depends(form_dict)):
     """Handle quiz submission and compute results."""
-    # Read raw body and parse URL-encoded form manually to avoid python-multipart dependency
-    body_bytes = await request.body()
-    parsed = urllib.parse.parse_qs(body_bytes.decode())
-    answers: Dict[str, str] = {}
-    for key, values in parsed.items():
-        if key.startswith("question-") and values:
-            qid = key.split("-", 1)[1]
-            answers[qid] = values[0]
+    # Integer ids bind straight to questions.id; non-numeric keys cannot match a question
+    answers: Dict[int, str] = {}
+    for key, value in form.items():
+        if key.startswith("question-"):
+            qid = key[9:]
+            if qid.isdecimal():
+                answers[int(qid)] = value
     if not answers:
         # If no answers were submitted, redirect back to quiz
         return RedirectResponse(url="/quiz", status_code=303)
-    placeholders = ",".join("?" for _ in answers)
-    with get_db() as conn:
-        cur = conn.execute(
-            f"SELECT id, correct_option FROM questions WHERE id IN ({placeholders})",
-            list(answers.keys()),
-        )
-        result_set = cur.fetchall()
-    total = len(result_set)
-    correct = 0
-    details = []
-    for row in result_set:
-        qid = str(row["id"])
-        correct_answer = row["correct_option"]
-        user_answer = answers.get(qid)
-        is_correct = user_answer == correct_answer
-        if is_correct:
-            correct += 1
-        details.append(
-            {
-                "id": qid,
-                "user_answer": user_answer,
-                "correct_answer": correct_answer,
-                "is_correct": is_correct,
-            }
-        )
+    # Pad to a power of two with (-1, NULL) pairs, which match no question, so only
+    # a handful of distinct scoring statements are ever prepared
+    size = 1 << (len(answers) - 1).bit_length()
+    params = [value for pair in answers.items() for value in pair]
+    params.extend([-1, None] * (size - len(answers)))
+    result_set = await asyncio.to_thread(fetch_all, score_query(size), params)
+    # Columns by position, in score_query order: id, user_answer, correct_option,
+    # is_correct, correct, total
+    total = result_set[0][5] if result_set else 0
+    correct = result_set[0][4] if result_set else 0
+    details = [
+        {
+            "id": str(row[0]),
+            "user_answer": row[1],
+            "correct_answer": row[2],
+            "is_correct": bool(row[3]),
+        }
+        for row in result_set
+    ]
     score_percent = 0.0
     if total > 0:
         score_percent = round((correct / total) * 100.0, 2)
@@ -190,15 +651,15 @@ async def submit_quiz(request: Request):
 
 
 @app.get("/admin", response_class=HTMLResponse)
-async def admin(
+def admin(
     request: Request,
     msg: Optional[str] = None,
     category: Optional[str] = None,
 ):
     """Display the admin interface with a list of questions."""
     with get_db() as conn:
-        cur = conn.execute("SELECT * FROM questions ORDER BY id")
-        questions = cur.fetchall()
+        conn.execute("BEGIN")
+        questions = get_admin_questions(conn, read_revision(conn))
     return templates.TemplateResponse(
         "admin.html",
         {
@@ -224,61 +685,60 @@ async def add_question_get(request: Request):
 
 
 @app.post("/admin/add", response_class=HTMLResponse)
-async def add_question_post(request: Request):
+async def add_question_post(data: Dict[str, str] = Depends(form_dict)):
     """Handle submission of a new question."""
-    body_bytes = await request.body()
-    data = urllib.parse.parse_qs(body_bytes.decode())
-
-    def get_field(field: str) -> str:
-        return data.get(field, [""])[0].strip()
-
-    question = get_field("question")
-    option_a = get_field("option_a")
-    option_b = get_field("option_b")
-    option_c = get_field("option_c")
-    option_d = get_field("option_d")
-    correct_option = get_field("correct_option")
-    tags = get_field("tags")
-    section = get_field("section")
-    with get_db() as conn:
-        conn.execute(
-            "INSERT INTO questions (question, option_a, option_b, option_c, option_d, correct_option, tags, section) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                question,
-                option_a,
-                option_b,
-                option_c,
-                option_d,
-                correct_option,
-                tags,
-                section,
-            ),
-        )
-        conn.commit()
+    payload = {field: data.get(field, "") for field in QUESTION_FIELDS}
+    async with get_write_db() as conn:
+        await asyncio.to_thread(insert_question, conn, payload)
+    await asyncio.to_thread(warm_caches)
     # Redirect to admin with success message
     return RedirectResponse(url="/admin?msg=题目已添加&category=success", status_code=303)
 
 
+@app.post("/admin/bulk_add")
+async def bulk_add_questions(request: Request):
+    """Insert a JSON array of question objects in a single transaction."""
+    try:
+        items = await request.json()
+    except ValueError:
+        items = None
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return JSONResponse({"error": "请求体必须是题目对象的 JSON 数组"}, status_code=400)
+    payloads = []
+    for index, item in enumerate(items, 1):
+        payload = question_payload(item)
+        if payload is None:
+            return JSONResponse(
+                {"error": f"第 {index} 个题目的字段无效：题干、四个选项和正确答案（A-D）必须是非空字符串，"
+                          "标签和分区必须是字符串或省略"},
+                status_code=400,
+            )
+        payloads.append(payload)
+    async with get_write_db() as conn:
+        added = await asyncio.to_thread(insert_questions, conn, payloads)
+    await asyncio.to_thread(warm_caches)
+    return JSONResponse({"added": added})
+
+
 @app.get("/admin/edit/{qid}", response_class=HTMLResponse)
-async def edit_question_get(request: Request, qid: int):
+def edit_question_get(request: Request, qid: int):
     """Render the form to edit an existing question."""
-    with get_db() as conn:
-        cur = conn.execute("SELECT * FROM questions WHERE id=?", (qid,))
-        row = cur.fetchone()
+    row = fetch_question(qid)
     if row is None:
         return RedirectResponse(
             url="/admin?msg=题目不存在&category=error", status_code=303
         )
+    _, question, option_a, option_b, option_c, option_d, correct_option, tags, section = row
     question_data = {
-        "id": row["id"],
-        "question": row["question"],
-        "option_a": row["option_a"],
-        "option_b": row["option_b"],
-        "option_c": row["option_c"],
-        "option_d": row["option_d"],
-        "correct_option": row["correct_option"],
-        "tags": row["tags"] or "",
-        "section": row["section"] or "",
+        "id": qid,
+        "question": question,
+        "option_a": option_a,
+        "option_b": option_b,
+        "option_c": option_c,
+        "option_d": option_d,
+        "correct_option": correct_option,
+        "tags": tags or "",
+        "section": section or "",
     }
     return templates.TemplateResponse(
         "add_edit.html",
@@ -291,45 +751,23 @@ async def edit_question_get(request: Request, qid: int):
 
 
 @app.post("/admin/edit/{qid}", response_class=HTMLResponse)
-async def edit_question_post(request: Request, qid: int):
+async def edit_question_post(qid: int, data: Dict[str, str] = Depends(form_dict)):
     """Handle submission of edits to an existing question."""
-    body_bytes = await request.body()
-    data = urllib.parse.parse_qs(body_bytes.decode())
-
-    def get_field(field: str) -> str:
-        return data.get(field, [""])[0].strip()
-
-    question = get_field("question")
-    option_a = get_field("option_a")
-    option_b = get_field("option_b")
-    option_c = get_field("option_c")
-    option_d = get_field("option_d")
-    correct_option = get_field("correct_option")
-    tags = get_field("tags")
-    section = get_field("section")
-    with get_db() as conn:
-        conn.execute(
-            "UPDATE questions SET question=?, option_a=?, option_b=?, option_c=?, option_d=?, correct_option=?, tags=?, section=? WHERE id=?",
-            (
-                question,
-                option_a,
-                option_b,
-                option_c,
-                option_d,
-                correct_option,
-                tags,
-                section,
-                qid,
-            ),
+    payload = {field: data.get(field, "") for field in QUESTION_FIELDS}
+    async with get_write_db() as conn:
+        updated = await asyncio.to_thread(update_question, conn, qid, payload)
+    if not updated:
+        return RedirectResponse(
+            url="/admin?msg=题目不存在&category=error", status_code=303
         )
-        conn.commit()
+    await asyncio.to_thread(warm_caches)
     return RedirectResponse(url="/admin?msg=题目已更新&category=success", status_code=303)
 
 
 @app.post("/admin/delete/{qid}", response_class=HTMLResponse)
 async def delete_question(request: Request, qid: int):
     """Delete a question from the database."""
-    with get_db() as conn:
-        conn.execute("DELETE FROM questions WHERE id=?", (qid,))
-        conn.commit()
+    async with get_write_db() as conn:
+        await asyncio.to_thread(remove_question, conn, qid)
+    await asyncio.to_thread(warm_caches)
     return RedirectResponse(url="/admin?msg=题目已删除&category=success", status_code=303)
\ No newline at end of file